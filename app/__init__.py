@@ -1,22 +1,53 @@
+import click
 from flask import Flask
-from .db import init_mongo
+from .db import init_mongo, ensure_indexes
 
 def create_app():
     app = Flask(__name__)
     
-    # Set secret key for session management
     import os
+
+    # load .env automatically in dev (optional but nice), once per process
+    if not os.getenv('DOTENV_LOADED'):
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except Exception:
+            pass
+        os.environ['DOTENV_LOADED'] = '1'
+
+    # Application logging; DEBUG output is dropped unless LOG_LEVEL asks for it
+    import logging
+    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    if log_level in logging.getLevelNamesMapping():
+        logging.basicConfig(level=log_level)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger(__name__).warning("Unknown LOG_LEVEL %r, using INFO", log_level)
+
+    # Set secret key for session management
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
-    # load .env automatically in dev (optional but nice)
-    try:
-        from dotenv import load_dotenv
-        load_dotenv()
-    except Exception:
-        pass
+    # Keep session data (user profile, meal plan) server-side in Redis so the
+    # cookie only carries a session id; plain cookie sessions without REDIS_URL
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        import redis
+        from flask_session import Session
+        app.config.update(
+            SESSION_TYPE='redis',
+            SESSION_REDIS=redis.Redis.from_url(redis_url),
+        )
+        Session(app)
 
     init_mongo()
 
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create the MongoDB indexes the app relies on."""
+        ensure_indexes()
+        click.echo("MongoDB indexes created.")
+
     from .routes import bp
     app.register_blueprint(bp)
 
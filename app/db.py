@@ -1,14 +1,67 @@
+import atexit
+import logging
 import os
+import threading
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
 
 client = None
 db = None
 
+# Set once the indexes are known to exist in this process
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
 def init_mongo():
     global client, db
+    # Reuse the existing client so repeated calls don't leak connection pools
+    if client is not None:
+        return db
+
     mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
     db_name = os.getenv("MONGO_DB", "gauchogrub")
 
-    client = MongoClient(mongo_uri)
+    client = MongoClient(
+        mongo_uri,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 5)),
+        serverSelectionTimeoutMS=3000,
+        connectTimeoutMS=3000,
+        socketTimeoutMS=10000,
+        retryWrites=True,
+        # Defer connecting until the first operation so it happens inside
+        # the worker (and its greenlets) rather than at import/fork time
+        connect=False,
+    )
+    atexit.register(client.close)
     db = client[db_name]
     return db
+
+def ensure_indexes():
+    """
+    Create the indexes the app relies on. Raises on failure; used by
+    `flask --app run init-db` and, best effort, by ensure_indexes_once().
+    """
+    global _indexes_ready
+    # Lookups by email stay index-backed, and signup relies on the unique
+    # constraint to reject duplicates
+    db.users.create_index("email", unique=True)
+    _indexes_ready = True
+
+def ensure_indexes_once():
+    """
+    Make sure the indexes exist, creating them at most once per process on
+    first use so app startup never needs a live database. Returns False (and
+    logs a warning) if they couldn't be created; the next call retries.
+    """
+    if _indexes_ready:
+        return True
+    with _indexes_lock:
+        if not _indexes_ready:
+            try:
+                ensure_indexes()
+            except PyMongoError:
+                logger.warning("Could not create MongoDB indexes", exc_info=True)
+    return _indexes_ready
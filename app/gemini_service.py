@@ -1,21 +1,126 @@
+from cachetools import TTLCache
 from google import genai
-import json
+from google.genai import types
+from pydantic import BaseModel
+import hashlib
+import logging
+import orjson
 import os
-from dotenv import load_dotenv
+import queue
+import simdjson
+import threading
+import time
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-api_key = os.environ.get("GENAI_API_KEY")
+# Gemini client, created on first use so importing this module doesn't
+# require GENAI_API_KEY (the app entrypoint loads .env before that)
+_client = None
 
-# Initialize Gemini client
-client = genai.Client(api_key=api_key)
+def _get_client():
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=os.environ.get("GENAI_API_KEY"))
+    return _client
+
+MODEL = "gemini-2.5-flash-lite"
+
+# Explicit Gemini context cache holding the static instructions + menu, so
+# each request only sends the user-specific part of the prompt
+CONTEXT_CACHE_TTL = 3600
+# Seconds to wait before trying to create the cache again after a failure
+CONTEXT_CACHE_RETRY = 300
+_context_cache_lock = threading.Lock()
+_context_cache_refreshing = False
+_CONTEXT_CACHE_NAME = None
+_CONTEXT_CACHE_MTIME = None
+_CONTEXT_CACHE_EXPIRES = 0.0
+
+# Structured output schema matching the format described in the prompt
+class RecommendedItem(BaseModel):
+    name: str
+    serving_size: str
+    calories: int
+    protein: int
+    carbs: int
+    fat: int
+    reason: str
+
+class PlannedMeal(BaseModel):
+    meal_number: int
+    dining_hall: str
+    meal_type: str
+    recommended_items: list[RecommendedItem]
+    total_calories: int
+    total_protein: int
+    total_carbs: int
+    total_fat: int
+    nutritional_balance: str
+
+class DailySummary(BaseModel):
+    total_calories: int
+    target_calories: int
+    calories_remaining: int
+    total_protein: int
+    total_carbs: int
+    total_fat: int
+    meets_goals: bool
+    nutritionist_notes: str
+
+class DietaryCompliance(BaseModel):
+    restrictions_honored: bool
+    notes: str
+
+class MealPlanSchema(BaseModel):
+    meal_plan: list[PlannedMeal]
+    daily_summary: DailySummary
+    dietary_compliance: DietaryCompliance
+
+# Parsed menu data, reused until the JSON file changes on disk
+_MENU_CACHE = None
+_MENU_MTIME = None
+# Serialized form of _MENU_CACHE that gets embedded in the prompt
+_MENU_JSON_STR = None
+
+# simdjson parsers keep reusable internal buffers but are not thread-safe.
+# A shared pool (rather than a thread-local, which becomes per-greenlet under
+# gevent) lets requests reuse them without sharing one concurrently
+_PARSER_POOL = queue.SimpleQueue()
+
+# Recently generated meal plans, keyed by a hash of the canonicalized request
+_MEAL_PLAN_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_meal_plan_cache_lock = threading.Lock()
+
+def _meal_plan_cache_key(request_data):
+    # Include the menu mtime so plans built from an older menu aren't reused
+    payload = orjson.dumps([request_data, _MENU_MTIME], option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def _parse_json_object(data):
+    try:
+        parser = _PARSER_POOL.get_nowait()
+    except queue.Empty:
+        parser = simdjson.Parser()
+    try:
+        doc = parser.parse(data)
+        if not isinstance(doc, simdjson.Object):
+            raise ValueError(f"Expected a JSON object, got {type(doc).__name__}")
+        # Materialize before the parser goes back to the pool, since the next
+        # parse invalidates documents it produced
+        return doc.as_dict()
+    finally:
+        _PARSER_POOL.put(parser)
 
 # Load menu data from JSON file
 def load_menu_data():
     """
     Load menu data from ucsb_dining_data.json
     In production, this would fetch from MongoDB based on selected dining halls
+
+    The parsed data is cached and only re-read when the file's mtime changes.
     """
+    global _MENU_CACHE, _MENU_MTIME, _MENU_JSON_STR
+
     # TODO: Replace with MongoDB query when ready
     # For now, load from JSON file for testing
     
@@ -26,8 +131,15 @@ def load_menu_data():
     # Construct path to ucsb_dining_data.json
     json_path = os.path.join(project_root, 'ucsb_dining_data.json')
 
-    with open(json_path, 'r') as f:
-        return json.load(f)
+    mtime = os.stat(json_path).st_mtime
+    if _MENU_CACHE is not None and mtime == _MENU_MTIME:
+        return _MENU_CACHE
+
+    with open(json_path, 'rb') as f:
+        _MENU_CACHE = orjson.loads(f.read())
+    _MENU_JSON_STR = orjson.dumps(compact_menu_data(_MENU_CACHE)).decode()
+    _MENU_MTIME = mtime
+    return _MENU_CACHE
     
     # COMMENTED OUT - Future MongoDB implementation:
     # def load_menu_data(dining_halls):
@@ -40,60 +152,67 @@ def load_menu_data():
     #             menu_data.append(hall_data)
     #     return menu_data
 
-def generate_meal_plan(request_data):
+def _compact_number(value):
+    # 340.0 -> 340 saves a couple of tokens per field
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def compact_menu_data(menu_data):
     """
-    Generate a personalized meal plan using Gemini AI
-    
-    Args:
-        request_data: Dictionary containing:
-            - user_profile: Dict with age, weight, height, activity_level, goal, dietary_restrictions, target_calories
-            - meals: List of meal selections with dining_hall and meal_type
-            - meal_count: Number of meals
-    
-    Returns:
-        Structured meal plan from Gemini
+    Rewrite the menu into the short-key form embedded in the prompt, dropping
+    fields the model doesn't need (unit_id, meal_id):
+    h = dining hall, m = meals, n = name, i = items, s = serving size,
+    c = calories, p = protein (g), cb = carbohydrates (g), f = fat (g)
     """
-    user_profile = request_data['user_profile']
-    meals = request_data['meals']
-    
-    # Load menu data
-    menu_data = load_menu_data()
-    
-    # Build comprehensive user context
-    user_context = f"""
-USER PROFILE:
-- Age: {user_profile['age']} years
-- Weight: {user_profile['weight']} lbs
-- Height: {user_profile['height']} in
+    return [
+        {
+            "h": hall["name"],
+            "m": [
+                {
+                    "n": meal["name"],
+                    "i": [
+                        {
+                            "n": item["name"],
+                            "s": item["serving_size"],
+                            "c": _compact_number(item["calories"]),
+                            "p": _compact_number(item["protein"]),
+                            "cb": _compact_number(item["total_carbohydrates"]),
+                            "f": _compact_number(item["total_fat"]),
+                        }
+                        for item in meal["items"]
+                    ],
+                }
+                for meal in hall["meals"]
+            ],
+        }
+        for hall in menu_data
+    ]
 
-- Activity Level: {user_profile['activity_level']}
-- Goal: {user_profile['goal']}
-- Dietary Restrictions: {', '.join(user_profile['dietary_restrictions']) if user_profile['dietary_restrictions'] else 'None'}
-- Target Daily Calories: {user_profile['target_calories']} kcal
+def get_menu_json_str():
+    """
+    Return the menu data serialized for the prompt, refreshing it if the
+    JSON file has changed since it was last loaded
+    """
+    load_menu_data()
+    return _MENU_JSON_STR
 
-MEAL PLAN REQUEST:
-The user wants {request_data['meal_count']} meal(s) today:
-"""
-    
-    for meal in meals:
-        user_context += f"\n- Meal #{meal['number']}: {meal['meal_type']} at {meal['dining_hall']}"
-    
-    # Construct the comprehensive prompt
-    prompt = f"""
+def build_static_context(menu_json_str):
+    """
+    Build the part of the prompt that is the same for every user: the
+    assistant instructions, the menu, dining hall rules and output format
+    """
+    return f"""
 You are an expert nutritionist and meal planning assistant for UCSB students.
 
-{user_context}
-
 AVAILABLE MENU DATA:
-{json.dumps(menu_data, indent=2)}
+The menu is a JSON list of dining halls using short keys:
+- "h": dining hall name, "m": list of meals (meal periods) at that hall
+- each meal: "n": meal name (e.g. Brunch, Dinner, Always Available), "i": list of items
+- each item: "n": item name, "s": serving size, "c": calories (kcal), "p": protein (g), "cb": carbohydrates (g), "f": fat (g)
+In your output, use the full item names and the field names from the OUTPUT FORMAT below.
 
-TASK:
-Create a personalized meal plan that:
-1. Fits within the user's target daily calories ({user_profile['target_calories']} kcal)
-2. Distributes calories appropriately across the {request_data['meal_count']} meal(s)
-3. Respects all dietary restrictions: {', '.join(user_profile['dietary_restrictions']) if user_profile['dietary_restrictions'] else 'None'}
-4. Aligns with the user's goal: {user_profile['goal']}
-5. Provides balanced nutrition (adequate protein, healthy fats, complex carbs)
+{menu_json_str}
 
 Restrictions Per Dining Hall: 
 - If at Ortega, can only select one entree, one side, one desert, and one piece of fruit (apple, orange, banana [you can estimate the average nutrition facts for these pieces of fruit]) per meal. There are no drinks available. 
@@ -128,7 +247,7 @@ OUTPUT FORMAT (JSON ONLY - NO MARKDOWN, NO PREAMBLE):
   ],
   "daily_summary": {{
     "total_calories": 2000,
-    "target_calories": {user_profile['target_calories']},
+    "target_calories": 2200,
     "calories_remaining": 200,
     "total_protein": 120,
     "total_carbs": 250,
@@ -149,40 +268,176 @@ IMPORTANT:
 - Consider the user's goal when selecting portion sizes and items
 """
 
-    # Call Gemini API
+def get_context_cache_name():
+    """
+    Return the name of a Gemini context cache holding the static prompt,
+    creating it on first use and recreating it when it is about to expire or
+    the menu file changes. Returns None if caching isn't available (e.g. the
+    prompt is under the model's minimum cacheable size), in which case the
+    caller should send the full prompt inline.
+    """
+    global _CONTEXT_CACHE_NAME, _CONTEXT_CACHE_MTIME, _CONTEXT_CACHE_EXPIRES
+    global _context_cache_refreshing
+
+    menu_json_str = get_menu_json_str()
+    # The lock only guards the bookkeeping, never the network call, so one
+    # slow caches.create() can't stall every other /meals request
+    with _context_cache_lock:
+        # Also covers a recent failed attempt (name is None until it expires)
+        if (_CONTEXT_CACHE_MTIME == _MENU_MTIME
+                and time.monotonic() < _CONTEXT_CACHE_EXPIRES):
+            return _CONTEXT_CACHE_NAME
+
+        if _context_cache_refreshing:
+            # Someone else is refreshing: keep using the current cache (it is
+            # refreshed a minute before it expires) unless the menu changed,
+            # in which case send the prompt inline
+            if _CONTEXT_CACHE_MTIME == _MENU_MTIME:
+                return _CONTEXT_CACHE_NAME
+            return None
+
+        _context_cache_refreshing = True
+        menu_mtime = _MENU_MTIME
+
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=prompt
+        cache = _get_client().caches.create(
+            model=MODEL,
+            config=types.CreateCachedContentConfig(
+                contents=[build_static_context(menu_json_str)],
+                ttl=f"{CONTEXT_CACHE_TTL}s",
+            ),
         )
+    except Exception:
+        logger.warning("Gemini context cache unavailable, sending full prompt", exc_info=True)
+        with _context_cache_lock:
+            # Don't retry the create call on every request
+            _CONTEXT_CACHE_NAME = None
+            _CONTEXT_CACHE_MTIME = menu_mtime
+            _CONTEXT_CACHE_EXPIRES = time.monotonic() + CONTEXT_CACHE_RETRY
+        return None
+    else:
+        with _context_cache_lock:
+            _CONTEXT_CACHE_NAME = cache.name
+            _CONTEXT_CACHE_MTIME = menu_mtime
+            # Refresh a minute early so requests never reference an expired
+            # cache. The previous cache isn't deleted: in-flight requests may
+            # still be using it, and it expires server-side on its own TTL
+            _CONTEXT_CACHE_EXPIRES = time.monotonic() + CONTEXT_CACHE_TTL - 60
+        return cache.name
+    finally:
+        with _context_cache_lock:
+            _context_cache_refreshing = False
+
+def generate_meal_plan(request_data):
+    """
+    Generate a personalized meal plan using Gemini AI
+    
+    Args:
+        request_data: Dictionary containing:
+            - user_profile: Dict with age, weight, height, activity_level, goal, dietary_restrictions, target_calories
+            - meals: List of meal selections with dining_hall and meal_type
+            - meal_count: Number of meals
+    
+    Returns:
+        Structured meal plan from Gemini
+    """
+    load_menu_data()
+    cache_key = _meal_plan_cache_key(request_data)
+    with _meal_plan_cache_lock:
+        cached = _MEAL_PLAN_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    user_profile = request_data['user_profile']
+    meals = request_data['meals']
+    
+    # Build comprehensive user context
+    user_context = f"""
+USER PROFILE:
+- Age: {user_profile['age']} years
+- Weight: {user_profile['weight']} lbs
+- Height: {user_profile['height']} in
+
+- Activity Level: {user_profile['activity_level']}
+- Goal: {user_profile['goal']}
+- Dietary Restrictions: {', '.join(user_profile['dietary_restrictions']) if user_profile['dietary_restrictions'] else 'None'}
+- Target Daily Calories: {user_profile['target_calories']} kcal
+
+MEAL PLAN REQUEST:
+The user wants {request_data['meal_count']} meal(s) today:
+"""
+    
+    user_context += "".join(
+        f"\n- Meal #{meal['number']}: {meal['meal_type']} at {meal['dining_hall']}"
+        for meal in meals
+    )
+    
+    # Only the user-specific part of the prompt is sent on each request; the
+    # static instructions and menu come from the context cache when possible
+    prompt = f"""
+{user_context}
+
+TASK:
+Create a personalized meal plan that:
+1. Fits within the user's target daily calories ({user_profile['target_calories']} kcal)
+2. Distributes calories appropriately across the {request_data['meal_count']} meal(s)
+3. Respects all dietary restrictions: {', '.join(user_profile['dietary_restrictions']) if user_profile['dietary_restrictions'] else 'None'}
+4. Aligns with the user's goal: {user_profile['goal']}
+5. Provides balanced nutrition (adequate protein, healthy fats, complex carbs)
+
+Set "target_calories" in the daily summary to {user_profile['target_calories']}.
+"""
+
+    # Call Gemini API
+    try:
+        cache_name = get_context_cache_name()
+        if cache_name:
+            response = _get_client().models.generate_content(
+                model=MODEL,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    cached_content=cache_name,
+                    response_mime_type="application/json",
+                    response_schema=MealPlanSchema
+                )
+            )
+        else:
+            response = _get_client().models.generate_content(
+                model=MODEL,
+                contents=build_static_context(get_menu_json_str()) + prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=MealPlanSchema
+                )
+            )
         
-        # Parse the response
-        response_text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        
-        response_text = response_text.strip()
-        
-        # Parse JSON
-        meal_plan = json.loads(response_text)
-        
-        return meal_plan
-        
-    except json.JSONDecodeError as e:
+        # Structured output is plain JSON, no markdown fences to strip
+        response_text = response.text
+    except Exception as e:
+        return {
+            "error": "Gemini API call failed",
+            "details": str(e)
+        }
+    
+    # response.text is None when there are no text parts (e.g. the prompt or
+    # output was blocked by safety filters, or no candidates came back)
+    if not response_text:
+        return {
+            "error": "Gemini returned an empty response",
+            "details": str(response.prompt_feedback or "No text in response")
+        }
+    
+    # Parse JSON
+    try:
+        meal_plan = _parse_json_object(response_text.encode())
+    except ValueError as e:
         # If JSON parsing fails, return structured error
         return {
             "error": "Failed to parse Gemini response",
             "raw_response": response.text,
             "parse_error": str(e)
         }
-    except Exception as e:
-        return {
-            "error": "Gemini API call failed",
-            "details": str(e)
-        }
\ No newline at end of file
+    
+    with _meal_plan_cache_lock:
+        _MEAL_PLAN_CACHE[cache_key] = meal_plan
+    return meal_plan
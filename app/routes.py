@@ -1,52 +1,97 @@
-from flask import Blueprint, render_template, request, session, jsonify
-from .db import db
+from flask import Blueprint, render_template, request, session, jsonify, abort
+from .db import db, ensure_indexes_once
 from bson.objectid import ObjectId
-from passlib.hash import bcrypt
-from datetime import datetime, timezone
-import json
-from .gemini_service import generate_meal_plan
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+import orjson
+import time
 
 bp = Blueprint("main", __name__)
 
+# passlib (and google.genai via gemini_service) are imported on first use so
+# workers that only serve /, /health or /items don't pay for them
+_pwd_context = None
+
+def _get_pwd_context():
+    # New hashes use argon2; existing bcrypt hashes still verify and are
+    # upgraded on the user's next successful login
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(
+            schemes=["argon2", "bcrypt"],
+            deprecated="auto",
+            argon2__rounds=3,
+            argon2__memory_cost=65536,
+            argon2__parallelism=2,
+        )
+    return _pwd_context
+
+ACTIVITY_MULTIPLIERS = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "active": 1.725,
+    "very-active": 1.9
+}
+
+GOAL_CALORIE_DELTA = {
+    "lose-weight": -500,
+    "gain-weight": 500,
+}
+
+# MongoDB's error code for a unique index violation
+DUPLICATE_KEY_CODE = 11000
+
 @bp.get("/")
 def home():
     return render_template("index.html")
 
 @bp.post("/signup")
 def signup():
-    data = request.get_json(force=True)
+    data = get_json_body()
     email = data["email"].strip().lower()
     try:
         password = normalize_password(data["password"])
     except ValueError as e:
         return {"error": str(e)}, 400
 
-    if db.users.find_one({"email": email}):
-        return {"error": "Email already exists"}, 409
-
     user_doc = {
         "email": email,
         "name": data.get("name", ""),
-        "password_hash": bcrypt.hash(password),
-        "created_at": datetime.now(timezone.utc),
+        "password_hash": _get_pwd_context().hash(password),
+        "created_at": int(time.time()),  # epoch seconds (UTC)
     }
-    res = db.users.insert_one(user_doc)
+    # The unique email index is what rejects duplicates; if it couldn't be
+    # created, fall back to a (racy) pre-check rather than allow them
+    if not ensure_indexes_once() and db.users.find_one({"email": email}, {"_id": 1}):
+        return {"error": "Email already exists"}, 409
+
+    try:
+        res = db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        return {"error": "Email already exists"}, 409
 
     return {"user_id": str(res.inserted_id)}, 201
 
 @bp.post("/login")
 def login():
-    data = request.get_json(force=True)
+    data = get_json_body()
     email = data["email"].strip().lower()
     try:
         password = normalize_password(data["password"])
     except ValueError as e:
         return {"error": str(e)}, 400
 
-    user = db.users.find_one({"email": email})
-    if not user or not bcrypt.verify(password, user["password_hash"]):
+    user = db.users.find_one({"email": email}, {"password_hash": 1})
+    if not user:
         return {"error": "Invalid credentials"}, 401
 
+    valid, new_hash = _get_pwd_context().verify_and_update(password, user["password_hash"])
+    if not valid:
+        return {"error": "Invalid credentials"}, 401
+    if new_hash:
+        db.users.update_one({"_id": user["_id"]}, {"$set": {"password_hash": new_hash}})
+
     return {"user_id": str(user["_id"])}
 
 @bp.post("/submit")
@@ -68,24 +113,8 @@ def submit():
     # BMR calculation (assuming gender-neutral for simplicity)
     #bmr = 10 * (weight/2.2) + 6.25 * (height/0.393701) - 5 * age + 5  # +5 for men, -161 for women if gender included
 
-    # Activity multiplier
-    activity_multipliers = {
-        "sedentary": 1.2,
-        "light": 1.375,
-        "moderate": 1.55,
-        "active": 1.725,
-        "very-active": 1.9
-    }
-    tdee = bmr * activity_multipliers.get(activity, 1.2)
-
-    # Adjust for goal
-    if goal == "lose-weight":
-        tdee -= 500
-    elif goal == "gain-weight":
-        tdee += 500
-    # maintain → leave unchanged
-
-    tdee = round(tdee)
+    # Activity multiplier, then adjust for goal (maintain → leave unchanged)
+    tdee = round(bmr * ACTIVITY_MULTIPLIERS.get(activity, 1.2) + GOAL_CALORIE_DELTA.get(goal, 0))
     
     # Store user data in session for later use
     session['user_profile'] = {
@@ -106,30 +135,33 @@ def generate_meals():
     """
     Process meal selections and generate personalized meal plan using Gemini
     """
+    from .gemini_service import generate_meal_plan
+
     # Get user profile from session
     user_profile = session.get('user_profile', {})
     
     if not user_profile:
         return {"error": "User profile not found. Please start over."}, 400
     
-    # Get meal selections from form
-    meal_swipes = request.form.get("meal_swipes")
+    # Get meal selections from form (flattened to a plain dict once)
+    form = request.form.to_dict()
+    meal_swipes = int(form.get("meal_swipes", 0))
     
     # Collect all meal selections
-    meals = []
-    for i in range(1, int(meal_swipes) + 1):
-        meal = {
+    meals = [
+        {
             'number': i,
-            'dining_hall': request.form.get(f"meal_{i}_hall"),
-            'meal_type': request.form.get(f"meal_{i}_type")
+            'dining_hall': form.get(f"meal_{i}_hall"),
+            'meal_type': form.get(f"meal_{i}_type")
         }
-        meals.append(meal)
+        for i in range(1, meal_swipes + 1)
+    ]
     
     # Prepare data for Gemini
     request_data = {
         'user_profile': user_profile,
         'meals': meals,
-        'meal_count': int(meal_swipes)
+        'meal_count': meal_swipes
     }
     
     # Call Gemini service to generate meal plan
@@ -158,15 +190,35 @@ def health():
 
 @bp.post("/items")
 def create_item():
-    data = request.get_json(force=True)
-    res = db.items.insert_one({"name": data["name"]})
-    return {"id": str(res.inserted_id)}, 201
+    data = get_json_body()
+    if not isinstance(data.get("name"), str):
+        return {"error": "name must be a string"}, 400
+
+    ids, failed = insert_items([data["name"]])
+    if failed:
+        return {"error": "Item could not be inserted", "failed": failed}, insert_error_status(failed)
+    return {"id": ids[0]}, 201
+
+@bp.post("/items/batch")
+def create_items_batch():
+    data = get_json_body()
+    items = data.get("items")
+    if (not isinstance(items, list) or not items
+            or not all(isinstance(it, dict) and isinstance(it.get("name"), str) for it in items)):
+        return {"error": "items must be a non-empty list of objects with a string name"}, 400
+
+    ids, failed = insert_items([it["name"] for it in items])
+    if failed:
+        # Partial failure is an error status, but the body still lists the
+        # ids that were inserted alongside the entries that weren't
+        return {"error": "Some items could not be inserted", "ids": ids, "failed": failed}, insert_error_status(failed)
+    return {"ids": ids}, 201
 
 @bp.get("/items")
 def list_items():
-    items = list(db.items.find().limit(50))
-    for it in items:
-        it["_id"] = str(it["_id"])
+    # Single pass over the cursor, fetching only the fields we return
+    cursor = db.items.find({}, {"name": 1}).limit(50).batch_size(50)
+    items = [{"_id": str(it["_id"]), "name": it.get("name")} for it in cursor]
     return {"items": items}
 
 @bp.delete("/items/<item_id>")
@@ -174,6 +226,52 @@ def delete_item(item_id):
     res = db.items.delete_one({"_id": ObjectId(item_id)})
     return {"deleted": res.deleted_count}
 
+def insert_items(names: list[str]) -> tuple[list[str], list[dict]]:
+    """
+    Insert one item per name. Returns (inserted ids, failures), where each
+    failure is {"index": position in names, "code": Mongo error code}.
+    """
+    # A single item is a plain insert_one; larger batches go out as one
+    # unordered bulk write instead of a round trip per document
+    if len(names) == 1:
+        try:
+            res = db.items.insert_one({"name": names[0]})
+        except WriteError as e:
+            return [], [{"index": 0, "code": e.code}]
+        return [str(res.inserted_id)], []
+
+    # insert_many assigns each doc its _id client-side, so the ids of the
+    # ones that made it in can be recovered after a partial failure
+    docs = [{"name": name} for name in names]
+    try:
+        db.items.insert_many(docs, ordered=False)
+        failed = []
+    except BulkWriteError as e:
+        failed = sorted(
+            ({"index": err["index"], "code": err["code"]} for err in e.details.get("writeErrors", [])),
+            key=lambda err: err["index"],
+        )
+
+    failed_indexes = {err["index"] for err in failed}
+    ids = [str(doc["_id"]) for i, doc in enumerate(docs) if i not in failed_indexes]
+    return ids, failed
+
+def insert_error_status(failed: list[dict]) -> int:
+    # 409 when every failure is a duplicate key, otherwise a plain 400
+    if all(err["code"] == DUPLICATE_KEY_CODE for err in failed):
+        return 409
+    return 400
+
+def get_json_body() -> dict:
+    # Mirror request.get_json(force=True): bad or non-object bodies are a 400
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        abort(400, description="Request body must be valid JSON.")
+    if not isinstance(data, dict):
+        abort(400, description="Request body must be a JSON object.")
+    return data
+
 def normalize_password(pw: str) -> str:
     pw = pw.strip()
     if len(pw.encode("utf-8")) > 72:
@@ -0,0 +1,8 @@
+# Must run before anything imports socket/ssl/threading (pymongo, requests,
+# google-genai) so blocking I/O yields to other greenlets
+from gevent import monkey
+monkey.patch_all()
+
+from app import create_app
+
+app = create_app()